@@ -1,13 +1,15 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, render_template, request, jsonify, redirect, url_for, g, has_request_context
 import sqlite3
 import requests
 import json
 import time
 import threading
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import statistics
 from contextlib import contextmanager
+from collections import deque, defaultdict
 import os
+import sys
 import logging
 
 app = Flask(__name__)
@@ -24,10 +26,124 @@ DATABASE = 'api_monitor.db'
 monitoring_active = False
 monitoring_threads = {}
 
+# SLO configuration
+SLO_OBJECTIVES = ('availability', 'latency')
+SLO_BURN_RATE_WINDOWS = [('1h', 60), ('6h', 6 * 60), ('3d', 3 * 24 * 60)]
+SLO_MAX_WINDOW_DAYS = 365
+
+# Profiling configuration (opt-in)
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'False').lower() == 'true'
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', '100'))
+SLOW_QUERY_LOG_SIZE = int(os.environ.get('SLOW_QUERY_LOG_SIZE', '200'))
+PROFILE_FORMATS = ('1', 'true', 'json', 'folded')
+
+slow_query_log = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+slow_query_lock = threading.Lock()
+
+class ProfiledConnection(sqlite3.Connection):
+    """SQLite connection that times every statement and logs slow ones"""
+    
+    def execute(self, sql, parameters=()):
+        start_time = time.perf_counter()
+        cursor = super().execute(sql, parameters)
+        # SQLite steps to the first row inside execute(), so sorts and
+        # aggregates are included; streaming the remaining rows is not.
+        duration_ms = (time.perf_counter() - start_time) * 1000
+        
+        statement = ' '.join(sql.split())
+        if has_request_context() and 'sql_statements' in g:
+            g.sql_statements.append({'sql': statement, 'duration_ms': duration_ms})
+        
+        if duration_ms >= SLOW_QUERY_THRESHOLD_MS:
+            self._record_slow_query(sql, statement, parameters, duration_ms)
+            
+        return cursor
+    
+    def _record_slow_query(self, sql, statement, parameters, duration_ms):
+        """Capture the query plan of a slow statement in the slow query log"""
+        try:
+            plan = [row[3] for row in super().execute(f'EXPLAIN QUERY PLAN {sql}', parameters)]
+        except sqlite3.Error as e:
+            plan = [f'Unavailable: {str(e)}']
+        
+        entry = {
+            'sql': statement,
+            # Bound values may hold credentials or URLs, so only count them
+            'parameter_count': len(parameters),
+            'duration_ms': duration_ms,
+            'plan': plan,
+            'route': request.path if has_request_context() else None,
+            'thread': threading.current_thread().name,
+            'timestamp': datetime.now().isoformat()
+        }
+        
+        with slow_query_lock:
+            slow_query_log.append(entry)
+        logger.warning(f"Slow query ({duration_ms:.1f} ms): {statement}")
+
+class RequestProfiler:
+    """Collect folded call stacks (flame graph format) for a single request"""
+    
+    def __init__(self):
+        self.stack = []
+        self.folded = defaultdict(float)
+        
+    def start(self):
+        """Start profiling the current thread"""
+        self.start_time = time.perf_counter()
+        sys.setprofile(self._profile_callback)
+        
+    def stop(self):
+        """Stop profiling and return the total duration in milliseconds"""
+        sys.setprofile(None)
+        duration_ms = (time.perf_counter() - self.start_time) * 1000
+        
+        # Close frames that were still open when profiling stopped
+        now = time.perf_counter()
+        while self.stack:
+            self._pop_frame(now)
+            
+        return duration_ms
+        
+    def folded_stacks(self):
+        """Return 'frame;frame;frame self_time_us' lines, slowest first"""
+        lines = sorted(self.folded.items(), key=lambda item: item[1], reverse=True)
+        return [f'{path} {int(seconds * 1000000)}' for path, seconds in lines
+                if seconds * 1000000 >= 1]
+        
+    def _profile_callback(self, frame, event, arg):
+        now = time.perf_counter()
+        
+        if event == 'call':
+            code = frame.f_code
+            label = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+        elif event == 'c_call':
+            label = getattr(arg, '__qualname__', getattr(arg, '__name__', repr(arg)))
+        elif event in ('return', 'c_return', 'c_exception'):
+            # Frames entered before profiling started have no stack entry
+            if self.stack:
+                self._pop_frame(now)
+            return
+        else:
+            return
+        
+        parent_path = self.stack[-1][0] + ';' if self.stack else ''
+        self.stack.append([parent_path + label, now, 0.0])
+        
+    def _pop_frame(self, now):
+        path, start, child_time = self.stack.pop()
+        elapsed = now - start
+        self.folded[path] += elapsed - child_time
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
 # Database helper functions
 @contextmanager
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
+    if PROFILING_ENABLED:
+        conn = sqlite3.connect(DATABASE, factory=ProfiledConnection)
+    else:
+        conn = sqlite3.connect(DATABASE)
     conn.row_factory = sqlite3.Row
     try:
         yield conn
@@ -86,8 +202,188 @@ def init_database():
             )
         ''')
         
+        # SLO definitions table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS slo_definitions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                endpoint_id INTEGER NOT NULL,
+                name TEXT NOT NULL UNIQUE,
+                objective TEXT DEFAULT 'availability',
+                target REAL NOT NULL,
+                threshold_ms REAL,
+                window_days INTEGER DEFAULT 30,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (endpoint_id) REFERENCES api_endpoints (id)
+            )
+        ''')
+        
+        # Per-minute good/total counters for each SLO. The cumulative columns
+        # hold running totals so any window sum is a difference of two rows.
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS slo_counters (
+                slo_id INTEGER NOT NULL,
+                minute INTEGER NOT NULL,
+                good INTEGER DEFAULT 0,
+                total INTEGER DEFAULT 0,
+                cum_good INTEGER DEFAULT 0,
+                cum_total INTEGER DEFAULT 0,
+                PRIMARY KEY (slo_id, minute),
+                FOREIGN KEY (slo_id) REFERENCES slo_definitions (id)
+            )
+        ''')
+        
         conn.commit()
 
+# SLO helper functions
+def _current_minute():
+    """Return the current UTC time as whole minutes since the epoch"""
+    return int(time.time() // 60)
+
+def _slo_window_minutes(slo):
+    """Return the longest window (in minutes) that must be kept for an SLO"""
+    return max(slo['window_days'] * 24 * 60, SLO_BURN_RATE_WINDOWS[-1][1])
+
+def _is_good_event(slo, success, response_time):
+    """Check whether a single check counts as good for the given SLO"""
+    if not success:
+        return False
+    if slo['objective'] == 'latency':
+        return response_time is not None and response_time <= slo['threshold_ms']
+    return True
+
+def record_slo_event(conn, endpoint_id, success, response_time):
+    """Add a check result to the per-minute counters of every SLO on an endpoint"""
+    minute = _current_minute()
+    slos = conn.execute('''
+        SELECT * FROM slo_definitions WHERE endpoint_id = ?
+    ''', (endpoint_id,)).fetchall()
+    
+    for slo in slos:
+        good = 1 if _is_good_event(slo, success, response_time) else 0
+        latest = conn.execute('''
+            SELECT minute, cum_good, cum_total FROM slo_counters
+            WHERE slo_id = ?
+            ORDER BY minute DESC
+            LIMIT 1
+        ''', (slo['id'],)).fetchone()
+        
+        if latest and latest['minute'] >= minute:
+            # Same minute (or clock went backwards): fold into the latest bucket
+            conn.execute('''
+                UPDATE slo_counters
+                SET good = good + ?, total = total + 1,
+                    cum_good = cum_good + ?, cum_total = cum_total + 1
+                WHERE slo_id = ? AND minute = ?
+            ''', (good, good, slo['id'], latest['minute']))
+        else:
+            cum_good = latest['cum_good'] if latest else 0
+            cum_total = latest['cum_total'] if latest else 0
+            conn.execute('''
+                INSERT INTO slo_counters
+                (slo_id, minute, good, total, cum_good, cum_total)
+                VALUES (?, ?, ?, 1, ?, ?)
+            ''', (slo['id'], minute, good, cum_good + good, cum_total + 1))
+            
+            # Buckets older than the longest window are never read again
+            conn.execute('''
+                DELETE FROM slo_counters WHERE slo_id = ? AND minute <= ?
+            ''', (slo['id'], minute - _slo_window_minutes(slo)))
+
+def backfill_slo_counters(conn, slo):
+    """Build the per-minute counters for a new SLO from stored metrics"""
+    since = datetime.now(timezone.utc) - timedelta(minutes=_slo_window_minutes(slo))
+    
+    if slo['objective'] == 'latency':
+        good_condition = 'success = 1 AND response_time <= ?'
+        params = (slo['threshold_ms'], slo['endpoint_id'], since.strftime('%Y-%m-%d %H:%M:%S'))
+    else:
+        good_condition = 'success = 1'
+        params = (slo['endpoint_id'], since.strftime('%Y-%m-%d %H:%M:%S'))
+    
+    buckets = conn.execute(f'''
+        SELECT 
+            CAST(strftime('%s', timestamp) AS INTEGER) / 60 as minute,
+            SUM(CASE WHEN {good_condition} THEN 1 ELSE 0 END) as good,
+            COUNT(*) as total
+        FROM api_metrics 
+        WHERE endpoint_id = ? AND timestamp > ?
+        GROUP BY minute
+        ORDER BY minute
+    ''', params).fetchall()
+    
+    cum_good = 0
+    cum_total = 0
+    for bucket in buckets:
+        cum_good += bucket['good']
+        cum_total += bucket['total']
+        conn.execute('''
+            INSERT OR REPLACE INTO slo_counters
+            (slo_id, minute, good, total, cum_good, cum_total)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (slo['id'], bucket['minute'], bucket['good'], bucket['total'],
+              cum_good, cum_total))
+
+def _slo_window_counts(conn, slo_id, latest, start_minute):
+    """Return (good, total) for all buckets at or after start_minute"""
+    first = conn.execute('''
+        SELECT good, total, cum_good, cum_total FROM slo_counters
+        WHERE slo_id = ? AND minute >= ?
+        ORDER BY minute
+        LIMIT 1
+    ''', (slo_id, start_minute)).fetchone()
+    
+    if latest is None or first is None:
+        return 0, 0
+    
+    good = latest['cum_good'] - (first['cum_good'] - first['good'])
+    total = latest['cum_total'] - (first['cum_total'] - first['total'])
+    return good, total
+
+def evaluate_slo(conn, slo):
+    """Evaluate an SLO and its multi-window burn rates from the minute counters"""
+    now = _current_minute()
+    error_budget = 1 - slo['target'] / 100
+    
+    latest = conn.execute('''
+        SELECT cum_good, cum_total FROM slo_counters
+        WHERE slo_id = ?
+        ORDER BY minute DESC
+        LIMIT 1
+    ''', (slo['id'],)).fetchone()
+    
+    windows = list(SLO_BURN_RATE_WINDOWS)
+    windows.append((f"{slo['window_days']}d", slo['window_days'] * 24 * 60))
+    
+    burn_rates = {}
+    good = total = 0
+    for label, minutes in windows:
+        good, total = _slo_window_counts(conn, slo['id'], latest, now - minutes + 1)
+        if total and error_budget > 0:
+            burn_rates[label] = ((total - good) / total) / error_budget
+        else:
+            burn_rates[label] = None
+    
+    # The last window evaluated is the SLO window itself
+    compliance = (good / total) * 100 if total else None
+    budget_remaining = None
+    if total and error_budget > 0:
+        budget_remaining = (1 - (total - good) / (error_budget * total)) * 100
+    
+    return {
+        'id': slo['id'],
+        'name': slo['name'],
+        'endpoint_id': slo['endpoint_id'],
+        'objective': slo['objective'],
+        'target': slo['target'],
+        'threshold_ms': slo['threshold_ms'],
+        'window_days': slo['window_days'],
+        'good_requests': good,
+        'total_requests': total,
+        'compliance': compliance,
+        'error_budget_remaining': budget_remaining,
+        'burn_rates': burn_rates
+    }
+
 class APIMonitor:
     """API monitoring class to handle individual endpoint monitoring"""
     
@@ -178,6 +474,7 @@ class APIMonitor:
                 (endpoint_id, response_time, status_code, success, error_message, response_size)
                 VALUES (?, ?, ?, ?, ?, ?)
             ''', (self.endpoint_id, response_time, status_code, success, error_message, response_size))
+            record_slo_event(conn, self.endpoint_id, success, response_time)
             conn.commit()
             
         # Update performance summary
@@ -217,6 +514,54 @@ class APIMonitor:
                       result['successful_requests'], result['failed_requests']))
                 conn.commit()
 
+# Request profiling hooks
+def _profile_requested():
+    """Return the requested profile format, or None if profiling is off"""
+    if not PROFILING_ENABLED:
+        return None
+    value = request.headers.get('X-Profile') or request.args.get('profile') or ''
+    value = value.strip().lower()
+    return value if value in PROFILE_FORMATS else None
+
+@app.before_request
+def start_request_profiling():
+    """Start profiling the request when asked via X-Profile or ?profile="""
+    if _profile_requested():
+        g.sql_statements = []
+        g.profiler = RequestProfiler()
+        g.profiler.start()
+
+@app.after_request
+def finish_request_profiling(response):
+    """Replace the response with the collected profile"""
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    
+    duration_ms = profiler.stop()
+    folded = profiler.folded_stacks()
+    
+    if _profile_requested() == 'folded':
+        # Plain folded stacks for flamegraph.pl / speedscope
+        return app.response_class('\n'.join(folded) + '\n', mimetype='text/plain')
+    
+    statements = g.pop('sql_statements', [])
+    return jsonify({
+        'route': request.path,
+        'status_code': response.status_code,
+        'duration_ms': duration_ms,
+        'sql_statements': statements,
+        'sql_time_ms': sum(statement['duration_ms'] for statement in statements),
+        'folded_stacks': folded
+    })
+
+@app.teardown_request
+def stop_request_profiling(error=None):
+    """Always stop the profiler, even when an exception skipped after_request"""
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+
 # Flask Routes
 @app.route('/')
 def dashboard():
@@ -357,6 +702,104 @@ def performance_summary():
         
     return jsonify([dict(row) for row in summary])
 
+@app.route('/api/slo', methods=['GET'])
+def get_slos():
+    """Get SLO compliance, error budget and burn rates for all SLOs"""
+    with get_db_connection() as conn:
+        slos = conn.execute('SELECT * FROM slo_definitions ORDER BY name').fetchall()
+        results = [evaluate_slo(conn, slo) for slo in slos]
+        
+    return jsonify(results)
+
+@app.route('/api/slo', methods=['POST'])
+def add_slo():
+    """Define a new SLO for an endpoint"""
+    data = request.get_json()
+    
+    required_fields = ['name', 'endpoint_id', 'target']
+    if not data or not all(field in data for field in required_fields):
+        return jsonify({'error': 'Missing required fields'}), 400
+    
+    # Grafana targets are "<slo name>.<metric>", so the name cannot contain a dot
+    if not isinstance(data['name'], str) or not data['name'].strip() or '.' in data['name']:
+        return jsonify({'error': 'SLO name must be a non-empty string without "."'}), 400
+    
+    objective = data.get('objective', 'availability')
+    if objective not in SLO_OBJECTIVES:
+        return jsonify({'error': f'Objective must be one of {", ".join(SLO_OBJECTIVES)}'}), 400
+    
+    if objective == 'latency' and data.get('threshold_ms') is None:
+        return jsonify({'error': 'Latency SLOs require threshold_ms'}), 400
+    
+    try:
+        # bool is an int subclass, so true/false would otherwise pass as 1/0
+        if any(isinstance(data.get(field), bool) for field in ('target', 'threshold_ms', 'window_days')):
+            raise TypeError
+        target = float(data['target'])
+        threshold_ms = float(data['threshold_ms']) if objective == 'latency' else None
+        window_days = data.get('window_days', 30)
+        if isinstance(window_days, float) and not window_days.is_integer():
+            raise ValueError
+        window_days = int(window_days)
+    except (ValueError, TypeError):
+        return jsonify({'error': 'target and threshold_ms must be numbers and '
+                                 'window_days a whole number of days'}), 400
+    
+    if not 0 < target < 100:
+        return jsonify({'error': 'Target must be a percentage between 0 and 100'}), 400
+    
+    if threshold_ms is not None and not threshold_ms > 0:
+        return jsonify({'error': 'threshold_ms must be greater than 0'}), 400
+    
+    if not 1 <= window_days <= SLO_MAX_WINDOW_DAYS:
+        return jsonify({'error': f'window_days must be between 1 and {SLO_MAX_WINDOW_DAYS}'}), 400
+    
+    try:
+        with get_db_connection() as conn:
+            endpoint = conn.execute('SELECT id FROM api_endpoints WHERE id = ?',
+                                    (data['endpoint_id'],)).fetchone()
+            if not endpoint:
+                return jsonify({'error': 'Endpoint not found'}), 404
+            
+            cursor = conn.execute('''
+                INSERT INTO slo_definitions 
+                (endpoint_id, name, objective, target, threshold_ms, window_days)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (
+                data['endpoint_id'],
+                data['name'],
+                objective,
+                target,
+                threshold_ms,
+                window_days
+            ))
+            
+            slo = conn.execute('SELECT * FROM slo_definitions WHERE id = ?',
+                               (cursor.lastrowid,)).fetchone()
+            backfill_slo_counters(conn, slo)
+            conn.commit()
+            
+        return jsonify({'message': 'SLO added successfully', 'id': slo['id']}), 201
+        
+    except sqlite3.IntegrityError:
+        return jsonify({'error': 'SLO name already exists'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/delete_slo/<int:slo_id>', methods=['POST'])
+def delete_slo(slo_id):
+    """Delete an SLO and its counters"""
+    try:
+        with get_db_connection() as conn:
+            conn.execute('DELETE FROM slo_counters WHERE slo_id = ?', (slo_id,))
+            conn.execute('DELETE FROM slo_definitions WHERE id = ?', (slo_id,))
+            conn.commit()
+            
+        return jsonify({'message': 'SLO deleted successfully'}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/delete_endpoint/<int:endpoint_id>', methods=['POST'])
 def delete_endpoint(endpoint_id):
     """Delete an endpoint and its metrics"""
@@ -370,6 +813,11 @@ def delete_endpoint(endpoint_id):
             # Delete from database
             conn.execute('DELETE FROM api_metrics WHERE endpoint_id = ?', (endpoint_id,))
             conn.execute('DELETE FROM performance_summary WHERE endpoint_id = ?', (endpoint_id,))
+            conn.execute('''
+                DELETE FROM slo_counters WHERE slo_id IN
+                (SELECT id FROM slo_definitions WHERE endpoint_id = ?)
+            ''', (endpoint_id,))
+            conn.execute('DELETE FROM slo_definitions WHERE endpoint_id = ?', (endpoint_id,))
             conn.execute('DELETE FROM api_endpoints WHERE id = ?', (endpoint_id,))
             conn.commit()
             
@@ -378,12 +826,41 @@ def delete_endpoint(endpoint_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Admin Endpoints
+@app.route('/admin/slow_queries')
+def get_slow_queries():
+    """Get captured slow SQL statements with their query plans, slowest first"""
+    if not PROFILING_ENABLED:
+        return jsonify({'error': 'Profiling is disabled'}), 404
+    
+    with slow_query_lock:
+        entries = list(slow_query_log)
+    
+    entries.sort(key=lambda entry: entry['duration_ms'], reverse=True)
+    
+    return jsonify({
+        'threshold_ms': SLOW_QUERY_THRESHOLD_MS,
+        'slow_queries': entries
+    })
+
+@app.route('/admin/slow_queries/clear', methods=['POST'])
+def clear_slow_queries():
+    """Clear the slow query log"""
+    if not PROFILING_ENABLED:
+        return jsonify({'error': 'Profiling is disabled'}), 404
+    
+    with slow_query_lock:
+        slow_query_log.clear()
+        
+    return jsonify({'message': 'Slow query log cleared'}), 200
+
 # Grafana Integration Endpoints
 @app.route('/grafana/search', methods=['POST', 'GET'])
 def grafana_search():
     """Grafana data source search endpoint"""
     with get_db_connection() as conn:
         endpoints = conn.execute('SELECT name FROM api_endpoints').fetchall()
+        slos = conn.execute('SELECT name, window_days FROM slo_definitions').fetchall()
     
     metrics = ['response_time', 'success_rate', 'request_count']
     targets = []
@@ -392,6 +869,13 @@ def grafana_search():
         for metric in metrics:
             targets.append(f"{endpoint['name']}.{metric}")
     
+    for slo in slos:
+        slo_metrics = ['slo_compliance', 'error_budget_remaining']
+        windows = [label for label, _ in SLO_BURN_RATE_WINDOWS] + [f"{slo['window_days']}d"]
+        slo_metrics += [f'burn_rate_{label}' for label in dict.fromkeys(windows)]
+        for metric in slo_metrics:
+            targets.append(f"{slo['name']}.{metric}")
+    
     return jsonify(targets)
 
 @app.route('/grafana/query', methods=['POST'])
@@ -413,9 +897,22 @@ def grafana_query():
             continue
             
         endpoint_name, metric = parts
+        datapoints = []
         
         with get_db_connection() as conn:
-            if metric == 'response_time':
+            if metric in ('slo_compliance', 'error_budget_remaining') or metric.startswith('burn_rate_'):
+                # SLO targets are "<slo name>.<metric>" and report the current value
+                slo = conn.execute('SELECT * FROM slo_definitions WHERE name = ?',
+                                   (endpoint_name,)).fetchone()
+                if slo:
+                    evaluation = evaluate_slo(conn, slo)
+                    if metric.startswith('burn_rate_'):
+                        value = evaluation['burn_rates'].get(metric[len('burn_rate_'):])
+                    else:
+                        value = evaluation[metric.replace('slo_', '')]
+                    if value is not None:
+                        datapoints = [[value, int(time.time() * 1000)]]
+            elif metric == 'response_time':
                 query_data = conn.execute('''
                     SELECT timestamp, response_time 
                     FROM api_metrics m